@@ -1,11 +1,19 @@
 import streamlit as st
 import requests
 import pandas as pd
+import numpy as np
 from datetime import datetime, timedelta
 from io import BytesIO
+from urllib.parse import urlencode
 from concurrent.futures import ThreadPoolExecutor, as_completed
+from itertools import chain, groupby
+import hashlib
 import pytz
+import orjson
+import xlsxwriter
+from xlsxwriter.utility import xl_col_to_name
 import logging
+import threading
 import time
 from requests.adapters import HTTPAdapter
 from urllib3.util.retry import Retry
@@ -18,6 +26,17 @@ console_handler = logging.StreamHandler()
 console_handler.setLevel(logging.CRITICAL)
 logger.addHandler(console_handler)
 
+# Concurrent API requests in flight; the connection pool is sized to match so workers never wait on a socket
+MAX_WORKERS = 20
+
+# Band label -> (API band id, measurement key in KPI responses)
+BANDS = {
+    "2.4GHz": ("2.4", "measurements24GHz"),
+    "5GHz": ("5", "measurements5GHz"),
+    "6GHz": ("6", "measurements6GHz"),
+}
+BAND_LABELS = list(BANDS)
+
 # KPI List Definition
 KPI_LIST = [
     {"code": "HC007", "description": "Wi-Fi Quality"},
@@ -58,10 +77,57 @@ KPI_LIST = [
  #   {"code": "TR151", "description": "QBSS station count"},
 ]
 
-@st.cache_data
+def round_like_builtin(values, ndigits):
+    """np.round over a float array, agreeing element-for-element with the builtin round()
+
+    np.round scales, rounds and unscales, so values sitting on a decimal tie can land on the other side of
+    it; those few elements are redone with round(), which rounds the exact binary value.
+    """
+    rounded = np.round(values, ndigits)
+    scaled = values * 10.0 ** ndigits
+    near_tie = np.abs(scaled - np.floor(scaled) - 0.5) < 1e-6
+    if near_tie.any():
+        rounded[near_tie] = [round(v, ndigits) for v in values[near_tie].tolist()]
+    return rounded
+
+SHEET_COLUMN_WIDTH = 23
+# Generated workbooks kept per browser session, keyed by report content
+EXCEL_CACHE_SIZE = 3
+
+def write_sheet(workbook, sheet_name, data, column_formats, header_format):
+    """Write a DataFrame's header and rows strictly in row order, as constant_memory mode requires"""
+    worksheet = workbook.add_worksheet(sheet_name)
+    # Column formats must be set before any row is flushed, otherwise they never reach the cells.
+    # Adjacent columns sharing a format are set with one ranged call (one <col> record each run).
+    first = 0
+    for fmt, run in groupby(column_formats.get(col) for col in data.columns):
+        last = first + sum(1 for _ in run) - 1
+        worksheet.set_column(first, last, SHEET_COLUMN_WIDTH, fmt)
+        first = last + 1
+    worksheet.write_row(0, 0, list(data.columns), header_format)
+    # Pick each column's typed writer once from its dtype, so cells skip write()'s per-value type dispatch;
+    # object columns can hold anything (e.g. an all-null count filled with ints), so they keep write()
+    writers = [
+        worksheet.write_number if pd.api.types.is_numeric_dtype(dtype)
+        else worksheet.write_string if isinstance(dtype, (pd.StringDtype, pd.CategoricalDtype))
+        else worksheet.write
+        for dtype in data.dtypes
+    ]
+    # Convert the whole frame to row lists once, with NaN already mapped to None (left as a blank cell)
+    rows = data.astype(object).where(data.notna(), None).values.tolist()
+    for r, row in enumerate(rows, start=1):
+        for c, value in enumerate(row):
+            if value is not None:
+                writers[c](r, c, value)
+    return worksheet
+
+# Not cached itself: get_excel_report memoizes it per session by a content digest of its inputs
 def generate_excel_report(pivot, summary_client_df, days_back, selected_days, business_start, business_end):
     output = BytesIO()
-    with pd.ExcelWriter(output, engine="xlsxwriter") as writer:
+    # constant_memory flushes each row as soon as the next one starts, keeping memory flat on large sheets
+    with xlsxwriter.Workbook(output, {"constant_memory": True}) as workbook:
+        # Formats are created once per workbook and shared by every sheet and cell that uses them
+        header_format = workbook.add_format({"bold": True, "border": 1, "align": "center", "valign": "top"})
         metadata = pd.DataFrame({
             "Info": [
                 f"Report generated for business hours ({business_start.strftime('%I:%M %p')} to {business_end.strftime('%I:%M %p')} ET)",
@@ -69,31 +135,36 @@ def generate_excel_report(pivot, summary_client_df, days_back, selected_days, bu
                 f"Total business days: {days_back:.2f}"
             ]
         })
-        metadata.to_excel(writer, sheet_name="Report Info", index=False)
+        write_sheet(workbook, "Report Info", metadata, {}, header_format)
+
+        percent_format = workbook.add_format({"num_format": "0.00%"})
+        decimal_format = workbook.add_format({"num_format": "0.00"})
+        integer_format = workbook.add_format({"num_format": "0"})
+        column_formats = {
+            col: decimal_format if col.startswith("SLA") else percent_format
+            for col in pivot.columns
+            if col not in ["Total Samples", "Total Critical Samples", "Sampling Rate (samples/hr)", "Avg Critical Hours Per Day"]
+        }
 
         if not pivot.empty:
-            pivot.to_excel(writer, sheet_name="Sensor Summary Report", index=False)
-            ws1 = writer.sheets["Sensor Summary Report"]
+            ws1 = write_sheet(workbook, "Sensor Summary Report", pivot, column_formats, header_format)
             total_row_1 = len(pivot) + 1
             ws1.write(total_row_1, 0, "Total")
             for col in ["Total Samples", "Total Critical Samples", "Avg Critical Hours Per Day"]:
                 if col in pivot.columns:
                     try:
                         idx = pivot.columns.get_loc(col)
-                        from xlsxwriter.utility import xl_col_to_name
                         col_letter = xl_col_to_name(idx)
-                        num_format = "0" if col == "Total Critical Samples" else "0.00"
                         ws1.write_formula(
                             total_row_1, idx,
                             f"=SUM({col_letter}2:{col_letter}{total_row_1})",
-                            writer.book.add_format({"num_format": num_format})
+                            integer_format if col == "Total Critical Samples" else decimal_format
                         )
                     except ValueError:
                         logger.warning(f"Column '{col}' not found or caused error in Excel export.")
 
         if not summary_client_df.empty:
-            summary_client_df.to_excel(writer, sheet_name="Agent Summary Report", index=False)
-            ws2 = writer.sheets["Agent Summary Report"]
+            ws2 = write_sheet(workbook, "Agent Summary Report", summary_client_df, column_formats, header_format)
             total_row_2 = len(summary_client_df) + 1
             ws2.write(total_row_2, 0, "Total")
             for col in summary_client_df.columns:
@@ -101,33 +172,38 @@ def generate_excel_report(pivot, summary_client_df, days_back, selected_days, bu
                     continue
                 try:
                     idx = summary_client_df.columns.get_loc(col)
-                    from xlsxwriter.utility import xl_col_to_name
                     col_letter = xl_col_to_name(idx)
-                    num_format = "0" if col == "Client Count" else "0.00"
                     ws2.write_formula(
                         total_row_2, idx,
                         f"=SUM({col_letter}2:{col_letter}{total_row_2})",
-                        writer.book.add_format({"num_format": num_format})
+                        integer_format if col == "Client Count" else decimal_format
                     )
                 except ValueError:
                     logger.warning(f"Column '{col}' not found or caused error in Excel export.")
-
-        for sheet_name, data in {
-            "Report Info": metadata,
-            "Sensor Summary Report": pivot,
-            "Agent Summary Report": summary_client_df
-        }.items():
-            if not data.empty:
-                worksheet = writer.sheets[sheet_name]
-                for i, col in enumerate(data.columns):
-                    if col in pivot.columns and col.startswith("SLA"):
-                        worksheet.set_column(i, i, 23, writer.book.add_format({"num_format": "0.00"}))
-                    elif col in pivot.columns and col not in ["Total Samples", "Total Critical Samples", "Sampling Rate (samples/hr)", "Avg Critical Hours Per Day"]:
-                        worksheet.set_column(i, i, 23, writer.book.add_format({"num_format": "0.00%"}))
-                    else:
-                        worksheet.set_column(i, i, 23)
-    output.seek(0)
-    return output
+    # Hand the buffer's bytes straight to download_button (one copy, no cursor to rewind)
+    return output.getvalue()
+
+def excel_report_key(pivot, summary_client_df, *report_args):
+    """Content digest of everything that goes into the workbook"""
+    digest = hashlib.blake2b(digest_size=16)
+    for frame in (pivot, summary_client_df):
+        digest.update(repr(list(frame.columns)).encode())
+        digest.update(pd.util.hash_pandas_object(frame, index=False).to_numpy().tobytes())
+    digest.update(repr(report_args).encode())
+    return digest.hexdigest()
+
+def get_excel_report(pivot, summary_client_df, *report_args):
+    """Return workbook bytes, reusing this session's copy when the report content is unchanged"""
+    cache = st.session_state.setdefault("excel_cache", {})
+    key = excel_report_key(pivot, summary_client_df, *report_args)
+    # Plain dict in insertion order: re-inserting on a hit keeps the least recently used entry first
+    data = cache.pop(key, None)
+    if data is None:
+        data = generate_excel_report(pivot, summary_client_df, *report_args)
+    cache[key] = data
+    while len(cache) > EXCEL_CACHE_SIZE:
+        del cache[next(iter(cache))]
+    return data
 
 # ========== UI SETUP ==========
 st.set_page_config(page_title="7SIGNAL Total Impact Report")
@@ -149,17 +225,23 @@ kpi_codes = [opt.split(" - ")[0] for opt in selected_kpis] if selected_kpis else
 
 if "networks" not in st.session_state:
     st.session_state.networks = []
+    st.session_state.network_objects = []
 
 # OPTIMIZATION 1: Add session for connection pooling with smart retry logic
 @st.cache_resource
 def get_session():
-    """Create a session with connection pooling and intelligent retry strategy"""
+    """Create a session with connection pooling and intelligent retry strategy
+
+    cache_resource shares this one Session with every browser session on the server, so the
+    bearer token must stay in per-request headers and never go into session.headers.
+    """
     session = requests.Session()
     
     # Configure retry strategy for different error types
+    # Kept short: safe_get() already retries 429/5xx with its own backoff, and the two layers multiply
     retry_strategy = Retry(
-        total=5,  # Maximum number of retries
-        backoff_factor=2,  # Exponential backoff: 2, 4, 8, 16, 32 seconds
+        total=2,  # Maximum number of retries
+        backoff_factor=0.2,  # Exponential backoff: 0.2, 0.4 seconds
         status_forcelist=[429, 500, 502, 503, 504],  # Retry on these status codes
         allowed_methods=["GET", "POST"],  # Retry on these methods
         raise_on_status=False  # Don't raise exception, let us handle it
@@ -167,43 +249,76 @@ def get_session():
     
     adapter = HTTPAdapter(
         pool_connections=10,
-        pool_maxsize=20,
+        pool_maxsize=MAX_WORKERS,
         max_retries=retry_strategy
     )
     session.mount('https://', adapter)
     return session
 
+def parse_json(r):
+    """Decode a response body with orjson (returns the same dict/list tree as r.json())"""
+    return orjson.loads(r.content)
+
+# OPTIMIZATION 6: Cache the token and topology lookups across Streamlit reruns
+@st.cache_data(ttl=1500, show_spinner=False)
+def request_token(cid, secret_digest, _secret):
+    """Fetch a client-credentials token; raises on failure so errors are never cached
+
+    Keyed on a digest of the secret: the underscore argument keeps the secret itself out of the cache key.
+    """
+    r = get_session().post(
+        "https://api-v2.7signal.com/oauth2/token",
+        data={"client_id": cid, "client_secret": _secret, "grant_type": "client_credentials"},
+        headers={"Content-Type": "application/x-www-form-urlencoded"},
+        timeout=10
+    )
+    r.raise_for_status()
+    return parse_json(r)["access_token"]
+
 def authenticate(cid, secret):
     """Authenticate with 7SIGNAL API"""
     try:
-        session = get_session()
-        r = session.post(
-            "https://api-v2.7signal.com/oauth2/token",
-            data={"client_id": cid, "client_secret": secret, "grant_type": "client_credentials"},
-            headers={"Content-Type": "application/x-www-form-urlencoded"},
-            timeout=10
-        )
-        if r.status_code == 200:
-            return r.json().get("access_token")
+        return request_token(cid, hashlib.sha256(secret.encode()).hexdigest(), secret)
     except Exception as e:
         logger.error(f"Auth failed: {e}")
     return None
 
+@st.cache_data(ttl=900, show_spinner=False)
+def get_service_areas(token):
+    """List sensor service areas, cached per bearer token"""
+    r = get_session().get("https://api-v2.7signal.com/topologies/sensors/serviceAreas", headers={"Authorization": f"Bearer {token}"}, timeout=10)
+    r.raise_for_status()
+    return parse_json(r).get("results", [])
+
+@st.cache_data(ttl=900, show_spinner=False)
+def get_networks(token):
+    """List sensor networks, cached per bearer token"""
+    r = get_session().get("https://api-v2.7signal.com/networks/sensors", headers={"Authorization": f"Bearer {token}"}, timeout=10)
+    r.raise_for_status()
+    return parse_json(r).get("results", [])
+
+# cache_resource hands back the stored list itself instead of unpickling a fresh copy on every hit;
+# callers only read the results, never mutate them
+@st.cache_resource(ttl=300, show_spinner=False)
+def get_results(token, url, _get):
+    """Fetch one KPI URL's results through _get (unhashed), cached per bearer token; raises on failure so misses are never cached"""
+    r = _get(url)
+    if r is None:
+        raise RuntimeError(f"Request failed: {url}")
+    return parse_json(r).get("results", [])
+
 if st.button("Load Networks"):
     token = authenticate(client_id, client_secret)
     if token:
-        session = get_session()
-        headers = {"Authorization": f"Bearer {token}"}
         try:
-            r = session.get("https://api-v2.7signal.com/networks/sensors", headers=headers, timeout=10)
-            if r.status_code == 200:
-                networks = [n["name"] for n in r.json().get("results", [])]
-                st.session_state.networks = sorted(networks)
+            # Keep the full network objects so Generate can resolve selections without another lookup
+            st.session_state.network_objects = get_networks(token)
+            st.session_state.networks = sorted({n["name"] for n in st.session_state.network_objects})
         except Exception as e:
             st.error(f"Failed to load networks: {e}")
 
 selected_networks = st.multiselect("Select Networks", options=st.session_state.networks)
-selected_bands = st.multiselect("Select Bands", options=["2.4GHz", "5GHz", "6GHz"], default=["2.4GHz", "5GHz"])
+selected_bands = st.multiselect("Select Bands", options=BAND_LABELS, default=["2.4GHz", "5GHz"])
 selected_days = st.multiselect("Select Days", options=["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"], default=["Monday", "Tuesday", "Wednesday", "Thursday", "Friday"])
 
 col1, col2 = st.columns(2)
@@ -228,23 +343,27 @@ et = pytz.timezone("US/Eastern")
 from_dt = et.localize(datetime.combine(from_date, business_start))
 to_dt = et.localize(datetime.combine(to_date, business_end))
 
-# Calculate business days and windows
+# Calculate business days and windows, vectorized over the calendar range
 day_map = {"Monday": 0, "Tuesday": 1, "Wednesday": 2, "Thursday": 3, "Friday": 4, "Saturday": 5, "Sunday": 6}
-selected_weekdays = {day_map[d] for d in selected_days}
-windows = []
-total_hours = 0
-cur_date = from_date
-
-while cur_date <= to_date:
-    if cur_date.weekday() in selected_weekdays:
-        s = et.localize(datetime.combine(cur_date, business_start))
-        e = et.localize(datetime.combine(cur_date, business_end))
-        if s < from_dt: s = from_dt
-        if e > to_dt: e = to_dt
-        if s < e:
-            windows.append((s, e))
-            total_hours += (e - s).total_seconds() / 3600
-    cur_date += timedelta(days=1)
+selected_weekdays = [day_map[d] for d in selected_days]
+days = pd.date_range(from_date, to_date, freq="D")
+days = days[days.weekday.isin(selected_weekdays)]
+
+def localize_days(day_index, t):
+    """Localize each day at wall-clock time t in ET (matches pytz localize(is_dst=False) across DST changes)"""
+    naive = day_index + pd.Timedelta(hours=t.hour, minutes=t.minute)
+    return naive.tz_localize(et, ambiguous=np.zeros(len(naive), dtype=bool), nonexistent=pd.Timedelta(hours=1))
+
+# The first/last windows already start at from_dt and end at to_dt, so no clipping is needed
+starts = localize_days(days, business_start)
+ends = localize_days(days, business_end)
+valid = starts < ends
+starts, ends = starts[valid], ends[valid]
+total_hours = (ends - starts).total_seconds().to_numpy().sum() / 3600
+
+# Epoch-millisecond bounds for the API, converted once rather than per request
+epoch, one_ms = pd.Timestamp(0, tz=et), pd.Timedelta(milliseconds=1)
+windows_ms = list(zip(((starts - epoch) // one_ms).tolist(), ((ends - epoch) // one_ms).tolist()))
 
 days_back = total_hours / bh_per_day
 if days_back == 0:
@@ -274,29 +393,40 @@ if st.button("Generate Report!"):
     progress_bar.progress(10)
     
     try:
-        service_areas = session.get("https://api-v2.7signal.com/topologies/sensors/serviceAreas", headers=headers, timeout=10).json().get("results", [])
-        all_networks = session.get("https://api-v2.7signal.com/networks/sensors", headers=headers, timeout=10).json().get("results", [])
-        networks = [n for n in all_networks if n.get("name") in selected_networks]
+        service_areas = get_service_areas(token)
+        # Filter the full list rather than a name-keyed map, so networks sharing a name are all kept
+        selected = set(selected_networks)
+        networks = [n for n in st.session_state.network_objects if n.get("name") in selected]
     except Exception as e:
         st.error(f"Failed to load base data: {e}")
         st.stop()
     
     progress_bar.progress(20)
 
+    # Shared 429 cool-down: once any worker is throttled, every worker holds off until Retry-After passes
+    # instead of each one spending a round trip to discover the same limit
+    throttle_lock = threading.Lock()
+    throttle = {"until": 0.0}
+
+    def wait_for_throttle():
+        with throttle_lock:
+            delay = throttle["until"] - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
     def safe_get(url, max_retries=3, retry_delay=1):
         """
-        Wrapper for safe API calls with session, throttling detection, and exponential backoff
+        Wrapper for safe API calls on the shared session, with throttling detection and exponential backoff
         
         Handles:
         - 429 (Too Many Requests) with exponential backoff
         - 5xx server errors with retry
         - Connection errors with retry
         """
-        session = get_session()
-        
         for attempt in range(max_retries):
+            wait_for_throttle()
             try:
-                r = session.get(url, headers=headers, timeout=15)
+                r = session.get(url, headers=headers, timeout=(3.05, 30))
                 
                 # Success
                 if r.status_code == 200:
@@ -306,8 +436,9 @@ if st.button("Generate Report!"):
                 elif r.status_code == 429:
                     retry_after = int(r.headers.get('Retry-After', retry_delay * (2 ** attempt)))
                     logger.warning(f"Rate limited (429). Waiting {retry_after}s before retry {attempt + 1}/{max_retries}")
+                    with throttle_lock:
+                        throttle["until"] = max(throttle["until"], time.monotonic() + retry_after)
                     if attempt < max_retries - 1:
-                        time.sleep(retry_after)
                         continue
                     else:
                         logger.error(f"Rate limit exceeded after {max_retries} attempts: {url}")
@@ -354,139 +485,177 @@ if st.button("Generate Report!"):
         
         return None
 
+    def fetch_results(url):
+        """Results list for one report URL, served from the short-lived cache when the same window was fetched recently"""
+        try:
+            return get_results(token, url, safe_get)
+        except RuntimeError:
+            return []
+
     # OPTIMIZATION 3: Batch KPI requests by combining all codes in one API call
-    def get_kpi_data_batch(sa, net, codes, band, window_list):
-        """Fetch all KPI codes in a single request per window"""
-        local_results = []
-        band_map = {"2.4GHz": "2.4", "5GHz": "5", "6GHz": "6"}
-        band_id = band_map[band]
-        band_key = {"2.4GHz": "measurements24GHz", "5GHz": "measurements5GHz", "6GHz": "measurements6GHz"}[band]
-        
-        # Combine all KPI codes into single request
-        kpi_params = "&".join([f"kpiCodes={code}" for code in codes])
-        
-        for f, t in window_list:
-            f_ts, t_ts = int(f.timestamp()*1000), int(t.timestamp()*1000)
-            url = f"https://api-v2.7signal.com/kpis/sensors/service-areas/{sa['id']}?{kpi_params}&from={f_ts}&to={t_ts}&networkId={net['id']}&band={band_id}&averaging=ALL"
-            r = safe_get(url)
-            if not r:
-                continue
-            for result in r.json().get("results", []):
-                for m in result.get(band_key, []):
-                    samples = m.get("samples", 0)
-                    sla = m.get("slaValue", 0)
-                    crit_samp = round(samples * (1 - sla / 100), 2)
-                    local_results.append({
-                        "Service Area": sa["name"],
-                        "Network": net["name"],
-                        "Band": band,
-                        "Samples": samples,
-                        "Critical Samples": crit_samp,
-                        "KPI Name": result.get("name"),
-                        "SLA Value": sla
-                    })
-        return local_results
+    def get_kpi_data_batch(sa, net, kpi_params, band, window):
+        """Fetch all KPI codes for one band and (from_ms, to_ms) window in a single request, returned as one list per column"""
+        band_code, band_id, band_key = band
+        samples, kpi_names, sla_values = [], [], []
+        f_ts, t_ts = window
+        # Windows can't be merged into one wide from/to span: averaging=ALL returns a single aggregate with no
+        # per-sample timestamps, so off-hours traffic could not be filtered out, and scaling by the business-hour
+        # share would misstate both samples and SLA (night and weekend load differs from business hours)
+        url = f"https://api-v2.7signal.com/kpis/sensors/service-areas/{sa['id']}?{kpi_params}&from={f_ts}&to={t_ts}&networkId={net['id']}&band={band_id}&averaging=ALL"
+        for result in fetch_results(url):
+            measurements = result.get(band_key, [])
+            samples.extend(m.get("samples") or 0 for m in measurements)
+            sla_values.extend(m.get("slaValue") or 0 for m in measurements)
+            kpi_names.extend([result.get("name")] * len(measurements))
+        n = len(samples)
+        return {
+            "Service Area": [sa["name"]] * n,
+            "Network": [net["name"]] * n,
+            "Band": [band_code] * n,
+            "Samples": samples,
+            "KPI Name": kpi_names,
+            "SLA Value": sla_values
+        }
+
+    def get_agent_locations(window):
+        """Fetch agent location KPIs for one (from_ms, to_ms) window"""
+        f_ts, t_ts = window
+        client_url = f"https://api-v2.7signal.com/kpis/agents/locations?from={f_ts}&to={t_ts}&type=ROAMING&type=ADJACENT_CHANNEL_INTERFERENCE&type=CO_CHANNEL_INTERFERENCE&type=COVERAGE&includeClientCount=true"
+        return fetch_results(client_url)
 
     # Initialize pivot as empty DataFrame with expected columns
     pivot = pd.DataFrame(columns=["Service Area", "Network", "Band", "Total Samples", "Total Critical Samples", "Sampling Rate (samples/hr)", "Avg Critical Hours Per Day"])
 
     # Process sensor data only if networks are available and kpi_codes is provided
-    if networks and kpi_codes:
-        status_text.text("Fetching sensor KPI data...")
-        progress_bar.progress(30)
-        
-        results = []
-        # OPTIMIZATION 4: Increase worker count for parallel processing
-        # Note: safe_get() handles rate limiting with exponential backoff
-        with ThreadPoolExecutor(max_workers=10) as ex:
-            # Submit batched requests (all KPIs per SA/network/band combination)
-            futures = [
-                ex.submit(get_kpi_data_batch, sa, net, kpi_codes, band, windows) 
-                for sa in service_areas 
-                for net in networks 
-                for band in selected_bands
-            ]
-            
-            completed = 0
-            total_futures = len(futures)
-            for f in as_completed(futures):
-                results.extend(f.result())
-                completed += 1
-                progress_bar.progress(30 + int(30 * completed / total_futures))
-
+    fetch_sensors = bool(networks and kpi_codes)
+    status_text.text("Fetching sensor and agent KPI data..." if fetch_sensors else "Fetching agent data...")
+    progress_bar.progress(30)
+
+    # Combine all KPI codes into a single query string, shared by every request
+    kpi_params = urlencode([("kpiCodes", code) for code in kpi_codes])
+    # (band category code, API band filter, response measurement key) resolved once for all jobs; codes index BAND_LABELS
+    band_jobs = [(BAND_LABELS.index(band), *BANDS[band]) for band in selected_bands]
+    # Each worker returns its own column lists; they are stitched together once after the fan-out
+    # rather than growing shared lists batch by batch
+    sensor_batches, client_batches = [], []
+    # OPTIMIZATION 4: Increase worker count for parallel processing
+    # Note: safe_get() handles rate limiting with exponential backoff
+    # Size the pool to the job count so small reports don't spin up idle threads
+    sensor_jobs = len(service_areas) * len(networks) * len(band_jobs) * len(windows_ms) if fetch_sensors else 0
+    with ThreadPoolExecutor(max_workers=max(1, min(MAX_WORKERS, sensor_jobs + len(windows_ms)))) as ex:
+        # Submit one request per SA/network/band/window (all KPIs batched into each), so every
+        # window is in flight concurrently instead of walked serially inside a worker
+        sensor_futures = {
+            ex.submit(get_kpi_data_batch, sa, net, kpi_params, band, window) 
+            for sa in service_areas 
+            for net in networks
+            for band in band_jobs
+            for window in windows_ms
+        } if fetch_sensors else set()
+        # The agent report is independent of the sensor one, so its windows share the same pool
+        # and the two fetches overlap instead of running back to back
+        agent_futures = {ex.submit(get_agent_locations, window) for window in windows_ms}
+
+        completed = 0
+        total_futures = len(sensor_futures) + len(agent_futures)
+        for f in as_completed(sensor_futures | agent_futures):
+            (sensor_batches if f in sensor_futures else client_batches).append(f.result())
+            completed += 1
+            progress_bar.progress(30 + int(40 * completed / total_futures))
+    client_results = list(chain.from_iterable(client_batches))
+
+    if fetch_sensors:
         status_text.text("Processing sensor data...")
-        progress_bar.progress(65)
+        progress_bar.progress(75)
         
-        df = pd.DataFrame(results)
+        n_rows = sum(len(batch["Samples"]) for batch in sensor_batches)
+
+        def column(col):
+            return chain.from_iterable(batch[col] for batch in sensor_batches)
+
+        # Numeric columns stream straight into preallocated arrays with no intermediate list
+        samples = np.fromiter(column("Samples"), dtype=np.float64, count=n_rows)
+        sla = np.fromiter(column("SLA Value"), dtype=np.float64, count=n_rows)
+        # Built column-wise from the batches; categorical keys let groupby factorize to
+        # integer codes, and observed=True below skips absent combinations
+        df = pd.DataFrame({
+            "Service Area": pd.Categorical(list(column("Service Area"))),
+            "Network": pd.Categorical(list(column("Network"))),
+            "Band": pd.Categorical.from_codes(np.fromiter(column("Band"), dtype=np.int8, count=n_rows), categories=BAND_LABELS),
+            "KPI Name": list(column("KPI Name")),
+            "Samples": samples,
+            "SLA Value": sla
+        }, copy=False)
         if not df.empty:
-            df["SLA Value"] = df["SLA Value"].round(4).astype(float)
-
-            pivot_kpi = df.pivot_table(index=["Service Area", "Network", "Band"], columns="KPI Name", values="SLA Value", aggfunc="mean").reset_index()
-            sla_columns = [col for col in pivot_kpi.columns if col not in ["Service Area", "Network", "Band"]]
-            pivot_kpi[sla_columns] = pivot_kpi[sla_columns] / 100
-
-            summary = df.groupby(["Service Area", "Network", "Band"]).agg({
-                "Samples": "sum",
-                "Critical Samples": "sum"
-            }).reset_index()
-            summary["Total Samples"] = summary["Samples"].round(0)
-            summary["Total Critical Samples"] = summary["Critical Samples"].round(0).astype(int)
-            summary["Sampling Rate (samples/hr)"] = summary["Samples"] / (days_back * bh_per_day)
-            summary["Avg Critical Hours Per Day"] = (summary["Critical Samples"] / summary["Samples"]) * bh_per_day
-
-            pivot = pivot_kpi.merge(summary.drop(columns=["Samples", "Critical Samples"]), on=["Service Area", "Network", "Band"])
-            numeric_cols = pivot.select_dtypes(include="number").columns.tolist()
-            cols_to_round_2 = [col for col in numeric_cols if col != "Total Critical Samples"]
-            pivot[cols_to_round_2] = pivot[cols_to_round_2].round(2)
-            pivot = pivot.sort_values(by="Avg Critical Hours Per Day", ascending=False).reset_index(drop=True)
+            # OPTIMIZATION 5: Compute critical samples for every measurement in one vectorized pass
+            df["Critical Samples"] = round_like_builtin(samples * (1 - sla / 100.0), 2)
+            df["SLA Value"] = np.round(sla, 4)
+
+            group_keys = ["Service Area", "Network", "Band"]
+            pivot_kpi = df.groupby(group_keys + ["KPI Name"], observed=True)["SLA Value"].mean().unstack("KPI Name")
+            # Scale to a fraction and round in place on one NumPy block rather than two DataFrame passes;
+            # copy=True because under copy-on-write to_numpy() may hand back a read-only view
+            sla_block = pivot_kpi.to_numpy(dtype=np.float64, copy=True)
+            np.divide(sla_block, 100.0, out=sla_block)
+            np.round(sla_block, 2, out=sla_block)
+            pivot_kpi = pd.DataFrame(sla_block, index=pivot_kpi.index, columns=pivot_kpi.columns)
+
+            # Aggregate straight into the final column names so no rename/drop copies are needed
+            summary = df.groupby(group_keys, sort=False, observed=True).agg(**{
+                "Total Samples": ("Samples", "sum"),
+                "Total Critical Samples": ("Critical Samples", "sum")
+            })
+            summary["Sampling Rate (samples/hr)"] = summary["Total Samples"] / (days_back * bh_per_day)
+            summary["Avg Critical Hours Per Day"] = (summary["Total Critical Samples"] / summary["Total Samples"]) * bh_per_day
+            rate_cols = ["Sampling Rate (samples/hr)", "Avg Critical Hours Per Day"]
+            summary[rate_cols] = np.round(summary[rate_cols].to_numpy(dtype=np.float64), 2)
+            summary["Total Samples"] = summary["Total Samples"].round(0)
+            summary["Total Critical Samples"] = summary["Total Critical Samples"].round(0).astype(int)
+
+            # Both frames are indexed by (Service Area, Network, Band): align on the index rather than re-hashing key columns in a merge
+            # Every column is already rounded, so the joined frame needs no further numeric pass
+            pivot = pivot_kpi.join(summary).reset_index()
+            pivot.sort_values(by="Avg Critical Hours Per Day", ascending=False, inplace=True, ignore_index=True)
         else:
             st.warning("No sensor data found for the provided KPI codes.")
     elif not networks:
         st.info("No sensor networks found. Generating report with agent data only.")
 
     # ====== CLIENT SUMMARY REPORT ======
-    status_text.text("Fetching agent data...")
-    progress_bar.progress(70)
-    
-    client_rows = []
-    client_count_dict = {}
-    
-    for f, t in windows:
-        f_ts, t_ts = int(f.timestamp()*1000), int(t.timestamp()*1000)
-        client_url = f"https://api-v2.7signal.com/kpis/agents/locations?from={f_ts}&to={t_ts}&type=ROAMING&type=ADJACENT_CHANNEL_INTERFERENCE&type=CO_CHANNEL_INTERFERENCE&type=COVERAGE&includeClientCount=true"
-        r = safe_get(client_url)
-        if r:
-            api_response = r.json()
-            for loc in api_response.get("results", []):
-                location_name = loc.get("locationName")
-                if location_name not in client_count_dict:
-                    client_count_dict[location_name] = loc.get("clientCount", 0)
-                else:
-                    client_count_dict[location_name] = max(client_count_dict[location_name], loc.get("clientCount", 0))
-                for t in loc.get("types", []):
-                    client_rows.append({
-                        "Location": location_name,
-                        "Type": t.get("type").replace("_", " ").title(),
-                        "Critical Hours Per Day": round((t.get("criticalSum") or 0) / 60 / days_back, 2)
-                    })
-    
     progress_bar.progress(85)
     status_text.text("Processing agent data...")
     
-    if client_rows:
-        client_df = pd.DataFrame(client_rows)
-        summary_client_df = client_df.pivot_table(index="Location", columns="Type", values="Critical Hours Per Day", aggfunc="mean").reset_index()
-        client_counts = pd.DataFrame([
-            {"Location": loc, "Client Count": count}
-            for loc, count in client_count_dict.items()
-        ])
-        summary_client_df = summary_client_df.merge(client_counts, on="Location", how="left")
+    # Flatten location -> types in one json_normalize call and do the arithmetic column-wise
+    located_types = [loc for loc in client_results if loc.get("types")]
+    if located_types:
+        types_df = pd.json_normalize(located_types, record_path="types", meta=["locationName"], errors="ignore").reindex(columns=["locationName", "type", "criticalSum"])
+        # criticalSum is in minutes; convert to hours per business day in one NumPy expression
+        critical_minutes = types_df["criticalSum"].to_numpy(dtype=np.float64, na_value=0.0)
+        # Categorical keys so groupby works on integer codes; Type is categorized after the label clean-up
+        # so its categories (and the sheet's column order) sort by the cleaned labels
+        client_df = pd.DataFrame({
+            "Location": types_df["locationName"].astype("category"),
+            "Type": types_df["type"].str.replace("_", " ").str.title().astype("category"),
+            "Critical Hours Per Day": round_like_builtin(critical_minutes / 60 / days_back, 2)
+        })
+        type_wide = client_df.groupby(["Location", "Type"], observed=True)["Critical Hours Per Day"].mean().unstack("Type")
+        # Peak client count per location across all windows (a missing count counts as 0)
+        client_counts = (
+            pd.DataFrame.from_records(client_results, columns=["locationName", "clientCount"])
+            .fillna({"clientCount": 0})
+            .groupby("locationName")["clientCount"].max()
+            .rename("Client Count")
+        )
+        # Both sides are keyed by location on the index: a left join there avoids re-hashing a key column in a merge
+        summary_client_df = type_wide.join(client_counts).reset_index()
         summary_client_df.insert(1, 'Client Count', summary_client_df.pop('Client Count'))
         summary_client_df.insert(2, 'Days Back', round(days_back, 2))
-        type_cols = [c for c in summary_client_df.columns if c not in ['Location', 'Client Count', "Days Back"]]
-        summary_client_df[type_cols] = summary_client_df[type_cols].round(2).fillna(0)
-        summary_client_df['Avg Critical Hours Per Day'] = summary_client_df[type_cols].mean(axis=1).round(2)
-        summary_client_df = summary_client_df.sort_values(by='Avg Critical Hours Per Day', ascending=False)
+        type_cols = summary_client_df.columns.difference(['Location', 'Client Count', "Days Back"], sort=False).tolist()
+        # One NumPy block for the round/fillna and the row mean instead of separate DataFrame passes
+        type_block = np.round(summary_client_df[type_cols].to_numpy(dtype=np.float64, na_value=0.0), 2)
+        summary_client_df[type_cols] = type_block
+        summary_client_df['Avg Critical Hours Per Day'] = np.round(type_block.mean(axis=1), 2)
+        summary_client_df.sort_values(by='Avg Critical Hours Per Day', ascending=False, inplace=True, ignore_index=True)
     else:
         summary_client_df = pd.DataFrame()
         st.warning("No client data found.")
@@ -497,11 +666,20 @@ if st.button("Generate Report!"):
     # Generate Excel report even if no data is available
     if pivot.empty and summary_client_df.empty:
         st.warning("No sensor or client data available. Generating report with metadata only.")
-    excel_data = generate_excel_report(pivot, summary_client_df, days_back, selected_days, business_start, business_end)
+    excel_data = get_excel_report(pivot, summary_client_df, days_back, selected_days, business_start, business_end)
     file_name = f"{account_name}_impact_report_{from_dt.date()}_to_{to_dt.date()}_business_hours.xlsx"
     
     progress_bar.progress(100)
     status_text.text("Report ready!")
     
     st.success("✅ Report generated successfully!")
-    st.download_button("Download Excel Report", data=excel_data, file_name=file_name, mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")
+    st.session_state.report_download = {"data": excel_data, "file_name": file_name}
+
+# Rendered outside the Generate branch from session state: clicking it reruns the script, and the button
+# (with the last report's bytes) must survive that rerun without rebuilding anything
+if "report_download" in st.session_state:
+    st.download_button(
+        "Download Excel Report",
+        mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+        **st.session_state.report_download
+    )